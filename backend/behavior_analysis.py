@@ -0,0 +1,186 @@
+import numpy as np
+
+# Thresholds used by the behavior heuristics
+DARK_BRIGHTNESS = 30  # Mean grayscale value below which the frame is considered too dark
+EYE_EDGE_RATIO = 0.2  # Eye centers closer than this to the face edge mean the student is looking away
+DROWSY_EYE_RATIO = 0.15  # Average eye height below this fraction of face height means drowsy
+TILT_RATIO = 1.5  # Face height above this multiple of face width means the head is tilted
+CENTER_MARGIN = 0.25  # Face center must lie within [margin, 1 - margin] of the frame
+
+# Compact per-frame analysis record
+FRAME_RECORD_DTYPE = np.dtype([
+    ("frame", np.int32),
+    ("has_face", np.bool_),
+    ("x", np.int32),
+    ("y", np.int32),
+    ("w", np.int32),
+    ("h", np.int32),
+    ("eye_count", np.int16),
+    ("brightness", np.float32),
+    ("face_size_ratio", np.float32),
+    ("tilt_ratio", np.float32),
+    ("eye_height_ratio", np.float32),
+    ("dark", np.bool_),
+    ("absent", np.bool_),
+    ("eyes_not_visible", np.bool_),
+    ("looking_away", np.bool_),
+    ("drowsy", np.bool_),
+    ("head_tilted", np.bool_),
+    ("not_centered", np.bool_),
+    ("active", np.bool_),
+])
+
+# Behavior flags in the order they are reported, with their severity and message
+BEHAVIOR_FLAGS = [
+    ("dark", "Dark environment", "medium", "Environment is too dark to detect face clearly"),
+    ("absent", "Absent", "high", "Student appears to be absent - no face detected"),
+    ("eyes_not_visible", "Eyes not visible", "medium", "Cannot detect eyes clearly - student may not be looking at screen"),
+    ("looking_away", "Looking away", "medium", "Student appears to be looking away from the screen"),
+    ("drowsy", "Drowsy", "medium", "Student appears to be drowsy or tired"),
+    ("head_tilted", "Head tilted", "low", "Student's head appears to be tilted"),
+    ("not_centered", "Not centered", "low", "Student not centered in camera view"),
+]
+ACTIVE_MESSAGE = "Student appears to be actively engaged"
+# Problems that keep the "Active" flag from overriding the message and severity
+ACTIVE_OVERRIDDEN_BY = ("Looking away", "Drowsy", "Head tilted", "Not centered")
+
+
+def _as_boxes(boxes):
+    """Return boxes as an (N, 4) int32 array, accepting empty cascade output"""
+    boxes = np.asarray(boxes, dtype=np.int32)
+    return boxes.reshape(-1, 4)
+
+
+def select_primary_faces(face_boxes, frame_ids, n_frames):
+    """Pick the largest face for every frame in a batch.
+
+    face_boxes is an (N, 4) array of (x, y, w, h) boxes from all frames and
+    frame_ids the (N,) frame index of each box. Ties keep the box that came
+    first, matching a stable sort by area. Returns an (n_frames, 4) array of
+    boxes and an (n_frames,) mask of frames that had a face.
+    """
+    face_boxes = _as_boxes(face_boxes)
+    frame_ids = np.asarray(frame_ids, dtype=np.intp).reshape(-1)
+    primary = np.zeros((n_frames, 4), dtype=np.int32)
+    has_face = np.zeros(n_frames, dtype=bool)
+    if len(face_boxes) == 0:
+        return primary, has_face
+
+    areas = face_boxes[:, 2].astype(np.int64) * face_boxes[:, 3]
+    # Sort by frame, then largest area, then original position
+    order = np.lexsort((np.arange(len(face_boxes)), -areas, frame_ids))
+    sorted_frames = frame_ids[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_frames[1:] != sorted_frames[:-1]
+
+    chosen = order[first]
+    primary[frame_ids[chosen]] = face_boxes[chosen]
+    has_face[frame_ids[chosen]] = True
+    return primary, has_face
+
+
+def pack_eye_boxes(eyes_per_frame):
+    """Pack per-frame eye detections into fixed-size arrays.
+
+    Returns an (n_frames, 2, 4) array with the first two eye boxes of every
+    frame (zero padded) and an (n_frames,) array with the number of eyes found.
+    """
+    n_frames = len(eyes_per_frame)
+    eye_pairs = np.zeros((n_frames, 2, 4), dtype=np.int32)
+    eye_counts = np.zeros(n_frames, dtype=np.int16)
+    for i, eyes in enumerate(eyes_per_frame):
+        eyes = _as_boxes(eyes)
+        eye_counts[i] = len(eyes)
+        eye_pairs[i, :min(len(eyes), 2)] = eyes[:2]
+    return eye_pairs, eye_counts
+
+
+def analyze_frames(frame_shapes, brightness, faces, has_face, eye_pairs, eye_counts):
+    """Run the behavior heuristics over a batch of frames.
+
+    frame_shapes is an (n, 2) array of (height, width), brightness the mean
+    grayscale value of each frame, faces the (n, 4) primary face boxes with
+    has_face marking which are valid, and eye_pairs/eye_counts the eye
+    detections inside each face as returned by pack_eye_boxes. Eye boxes are
+    relative to the face region. Returns an array of FRAME_RECORD_DTYPE.
+    """
+    frame_shapes = np.asarray(frame_shapes, dtype=np.int64).reshape(-1, 2)
+    brightness = np.asarray(brightness, dtype=np.float64).reshape(-1)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 4)
+    has_face = np.asarray(has_face, dtype=bool).reshape(-1)
+    eye_pairs = np.asarray(eye_pairs, dtype=np.int64).reshape(-1, 2, 4)
+    eye_counts = np.asarray(eye_counts, dtype=np.int64).reshape(-1)
+    n = len(frame_shapes)
+
+    records = np.zeros(n, dtype=FRAME_RECORD_DTYPE)
+    records["frame"] = np.arange(n)
+    records["has_face"] = has_face
+    records["x"], records["y"], records["w"], records["h"] = faces.T
+    records["eye_count"] = np.where(has_face, eye_counts, 0)
+    records["brightness"] = brightness
+
+    no_face = ~has_face
+    very_dark = brightness < DARK_BRIGHTNESS
+    records["dark"] = no_face & very_dark
+    records["absent"] = no_face & ~very_dark
+
+    x, y, w, h = faces.T
+    frame_h, frame_w = frame_shapes.T
+    # Avoid dividing by zero for frames without a face
+    safe_w = np.where(w > 0, w, 1)
+    safe_h = np.where(h > 0, h, 1)
+
+    # Eyes
+    two_eyes = has_face & (eye_counts >= 2)
+    records["eyes_not_visible"] = has_face & (eye_counts < 2)
+    eye_x = eye_pairs[:, :, 0] + eye_pairs[:, :, 2] // 2
+    looking_away = (eye_x.min(axis=1) < EYE_EDGE_RATIO * w) | (eye_x.max(axis=1) > (1 - EYE_EDGE_RATIO) * w)
+    records["looking_away"] = two_eyes & looking_away
+    eye_height_ratio = eye_pairs[:, :, 3].mean(axis=1) / safe_h
+    records["eye_height_ratio"] = np.where(two_eyes, eye_height_ratio, 0)
+    records["drowsy"] = two_eyes & (eye_height_ratio < DROWSY_EYE_RATIO)
+
+    # Orientation
+    tilt_ratio = h / safe_w
+    records["tilt_ratio"] = np.where(has_face, tilt_ratio, 0)
+    records["head_tilted"] = has_face & (h > TILT_RATIO * w)
+
+    # Position in frame
+    center_x = x + w // 2
+    center_y = y + h // 2
+    records["face_size_ratio"] = np.where(has_face, (w * h) / np.maximum(frame_w * frame_h, 1), 0)
+    well_positioned = (
+        (CENTER_MARGIN * frame_w <= center_x) & (center_x <= (1 - CENTER_MARGIN) * frame_w) &
+        (CENTER_MARGIN * frame_h <= center_y) & (center_y <= (1 - CENTER_MARGIN) * frame_h)
+    )
+    records["not_centered"] = has_face & ~well_positioned
+    records["active"] = has_face & ((eye_counts >= 1) | well_positioned)
+    return records
+
+
+def record_to_result(record):
+    """Turn one analysis record into behaviors, severity and message.
+
+    Behaviors are reported in a fixed order and the last one reported sets
+    the severity and message, the same way the live handler builds its result.
+    """
+    behaviors = []
+    severity = "low"
+    message = None
+    for field, behavior, behavior_severity, behavior_message in BEHAVIOR_FLAGS:
+        if record[field]:
+            behaviors.append(behavior)
+            severity = behavior_severity
+            message = behavior_message
+
+    if record["active"]:
+        behaviors.append("Active")
+        # Don't override severity if there are higher-priority problems
+        if not any(b in behaviors for b in ACTIVE_OVERRIDDEN_BY):
+            message = ACTIVE_MESSAGE
+            severity = "low"
+
+    result = {"behaviors": behaviors, "severity": severity}
+    if message is not None:
+        result["message"] = message
+    return result
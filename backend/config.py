@@ -16,6 +16,12 @@ DEBUG = os.getenv("DEBUG", "True").lower() in ("true", "1", "t")
 # In production, replace with specific origins
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
+# Watchdog settings (milliseconds)
+WATCHDOG_LAG_THRESHOLD_MS = float(os.getenv("WATCHDOG_LAG_THRESHOLD_MS", "100"))
+WATCHDOG_SLOW_CALL_MS = float(os.getenv("WATCHDOG_SLOW_CALL_MS", "500"))
+# Token required in the X-Admin-Token header for the watchdog admin endpoints; empty disables them
+WATCHDOG_ADMIN_TOKEN = os.getenv("WATCHDOG_ADMIN_TOKEN", "")
+
 # Validate required settings
 if not AGORA_APP_ID or not AGORA_APP_CERTIFICATE:
     print("Warning: Agora App ID or App Certificate not set in environment variables.")
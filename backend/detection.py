@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from behavior_analysis import select_primary_faces, pack_eye_boxes, analyze_frames
+
+# Behavior detection models - Load at import so every process has its own copy
+face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+profile_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_profileface.xml')
+
+
+def detect_frames(grays):
+    """Run the face and eye cascades over a batch of grayscale frames.
+
+    Returns one analysis record per frame (see behavior_analysis.FRAME_RECORD_DTYPE).
+    """
+    face_boxes = []
+    face_frame_ids = []
+    for i, gray in enumerate(grays):
+        # Detect faces - both frontal and profile with improved parameters
+        frontal_faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(30, 30))
+        profile_faces = profile_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(30, 30))
+        for faces in (frontal_faces, profile_faces):
+            faces = np.reshape(faces, (-1, 4))
+            face_boxes.append(faces)
+            face_frame_ids.append(np.full(len(faces), i))
+
+    n_frames = len(grays)
+    primary_faces, has_face = select_primary_faces(
+        np.concatenate(face_boxes) if face_boxes else np.empty((0, 4)),
+        np.concatenate(face_frame_ids) if face_frame_ids else np.empty(0),
+        n_frames,
+    )
+
+    # Detect eyes within the largest face region of each frame
+    eyes_per_frame = []
+    for gray, (x, y, w, h), found in zip(grays, primary_faces, has_face):
+        eyes_per_frame.append(eye_cascade.detectMultiScale(gray[y:y+h, x:x+w]) if found else ())
+    eye_pairs, eye_counts = pack_eye_boxes(eyes_per_frame)
+
+    frame_shapes = [gray.shape[:2] for gray in grays]
+    brightness = [np.mean(gray) for gray in grays]
+    return analyze_frames(frame_shapes, brightness, primary_faces, has_face, eye_pairs, eye_counts)
+
+
+def analyze_user_behavior_pattern(user_key, current_behaviors, history_store):
+    """Analyze behavior patterns over time for a user"""
+    if user_key not in history_store:
+        history_store[user_key] = []
+
+    # Add current behaviors to history with timestamp
+    history_store[user_key].append({
+        "timestamp": datetime.now().isoformat(),
+        "behaviors": current_behaviors
+    })
+
+    # Keep only the last 15 records for better pattern detection
+    if len(history_store[user_key]) > 15:
+        history_store[user_key] = history_store[user_key][-15:]
+
+    # Need at least 3 records for pattern detection
+    history = history_store[user_key]
+    if len(history) < 3:
+        return None
+
+    # Check for consistent behaviors in the last 5 records
+    behavior_counts = {}
+    for record in history[-5:]:
+        for behavior in record["behaviors"]:
+            if behavior not in behavior_counts:
+                behavior_counts[behavior] = 0
+            behavior_counts[behavior] += 1
+
+    # Consider a behavior consistent if it appears in at least 3 of the last 5 frames
+    # Give priority to active behaviors - if "Active" appears in 2+ frames, we shouldn't mark "Absent"
+    if "Active" in behavior_counts and behavior_counts["Active"] >= 2:
+        # If student is active in at least 2 frames, they're definitely not consistently absent
+        consistent_behaviors = [behavior for behavior, count in behavior_counts.items()
+                              if count >= 3 and behavior != "Absent"]
+    else:
+        consistent_behaviors = [behavior for behavior, count in behavior_counts.items()
+                              if count >= 3]
+
+    # Don't allow contradictory behaviors (active and absent) to both be consistent
+    if "Active" in consistent_behaviors and "Absent" in consistent_behaviors:
+        consistent_behaviors.remove("Absent")
+
+    # Looking away shouldn't be marked consistent unless it's in 4+ frames
+    if "Looking away" in behavior_counts and behavior_counts["Looking away"] < 4:
+        if "Looking away" in consistent_behaviors:
+            consistent_behaviors.remove("Looking away")
+
+    if consistent_behaviors:
+        return consistent_behaviors
+    return None
+
+
+def apply_consistent_behaviors(behavior_result, consistent_behaviors):
+    """Raise severity and update the message of a result for consistent behaviors"""
+    behavior_result["consistent_behaviors"] = consistent_behaviors
+
+    # If the same behavior is detected multiple times, increase the severity
+    if behavior_result["severity"] == "low":
+        behavior_result["severity"] = "medium"
+    elif behavior_result["severity"] == "medium" and "Absent" in consistent_behaviors:
+        behavior_result["severity"] = "high"
+
+    # Update message to reflect consistency
+    if "Absent" in consistent_behaviors:
+        behavior_result["message"] = "Student has been consistently absent"
+    elif "Drowsy" in consistent_behaviors:
+        behavior_result["message"] = "Student appears to be consistently drowsy or tired"
+    elif "Looking away" in consistent_behaviors:
+        behavior_result["message"] = "Student is consistently looking away from the screen"
+    elif "Active" in consistent_behaviors and len(consistent_behaviors) == 1:
+        behavior_result["message"] = "Student is consistently engaged and attentive"
+        behavior_result["severity"] = "low"  # Being active is good
+    else:
+        behavior_result["message"] = f"Consistently showing: {', '.join(consistent_behaviors)}"
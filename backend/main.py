@@ -5,6 +5,7 @@ from typing import Dict, List, Optional, Set
 import uvicorn
 import json
 import uuid
+import hmac
 import os
 from datetime import datetime
 import asyncio
@@ -17,6 +18,9 @@ from PIL import Image
 import io
 import time
 import random
+from behavior_analysis import record_to_result
+from detection import detect_frames, analyze_user_behavior_pattern, apply_consistent_behaviors
+from monitoring import Watchdog
 
 # For Agora token generation
 from agora_token_builder import RtcTokenBuilder
@@ -32,6 +36,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Watchdog for event loop lag and slow handlers
+watchdog = Watchdog(
+    lag_threshold=config.WATCHDOG_LAG_THRESHOLD_MS / 1000,
+    slow_call_threshold=config.WATCHDOG_SLOW_CALL_MS / 1000
+)
+
 # In-memory storage - In production, use a database
 active_rooms = {}
 connected_clients: Dict[str, Set[WebSocket]] = {}
@@ -42,11 +52,6 @@ last_reported_behaviors: Dict[str, Dict] = {}
 # Timestamps of last alerts sent per user
 last_alert_times: Dict[str, float] = {}
 
-# Behavior detection models - Load at startup
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-profile_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_profileface.xml')
-
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
@@ -66,6 +71,10 @@ class ConnectionManager:
                 print(f"WebSocket client disconnected from channel {channel}. Remaining clients: {len(self.active_connections[channel])}")
 
     async def broadcast_to_channel(self, message: str, channel: str):
+        with watchdog.track("broadcast_to_channel", channel=channel):
+            await self._broadcast(message, channel)
+
+    async def _broadcast(self, message: str, channel: str):
         if channel in self.active_connections:
             disconnected_websockets = []
             
@@ -104,6 +113,12 @@ manager = ConnectionManager()
 async def startup_event():
     # Start the ping task in the background
     asyncio.create_task(manager.start_ping())
+    # Start measuring event loop lag
+    watchdog.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    watchdog.stop()
 
 # Request body parser middleware
 @app.middleware("http")
@@ -194,6 +209,55 @@ async def join_room(room_id: str, request: Request):
         "isHost": is_host
     }
 
+# Admin APIs for the event loop watchdog
+def require_watchdog_admin(request: Request):
+    if not config.WATCHDOG_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Watchdog admin endpoints are disabled")
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode(), config.WATCHDOG_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/api/admin/watchdog")
+async def get_watchdog_report(request: Request):
+    require_watchdog_admin(request)
+    return watchdog.report()
+
+@app.post("/api/admin/watchdog/profile")
+async def profile_event_loop(request: Request):
+    require_watchdog_admin(request)
+    data = request.state.json_body
+    
+    try:
+        seconds = float(data.get("seconds", 5))
+        limit = int(data.get("limit", 30))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="seconds and limit must be numbers")
+    if not 0 < seconds <= 60:
+        raise HTTPException(status_code=400, detail="seconds must be between 0 and 60")
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be a positive integer")
+    
+    try:
+        stats = await watchdog.profile(seconds, limit=limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return {"seconds": seconds, "stats": stats}
+
+@app.post("/api/admin/watchdog/tracemalloc")
+async def toggle_tracemalloc(request: Request):
+    require_watchdog_admin(request)
+    data = request.state.json_body
+    enabled = data.get("enabled", True)
+    if not isinstance(enabled, bool):
+        raise HTTPException(status_code=400, detail="enabled must be true or false")
+    
+    enabled = watchdog.set_tracemalloc(enabled)
+    return {
+        "tracemalloc": enabled,
+        "top_allocations": watchdog.allocation_snapshot()
+    }
+
 # Behavior detection APIs
 @app.post("/api/behavior/start")
 async def start_behavior_detection(request: Request):
@@ -210,57 +274,6 @@ async def start_behavior_detection(request: Request):
     
     return {"status": "Behavior detection started"}
 
-def analyze_user_behavior_pattern(user_key, current_behaviors):
-    """Analyze behavior patterns over time for a user"""
-    if user_key not in user_analysis_history:
-        user_analysis_history[user_key] = []
-    
-    # Add current behaviors to history with timestamp
-    user_analysis_history[user_key].append({
-        "timestamp": datetime.now().isoformat(),
-        "behaviors": current_behaviors
-    })
-    
-    # Keep only the last 15 records for better pattern detection
-    if len(user_analysis_history[user_key]) > 15:
-        user_analysis_history[user_key] = user_analysis_history[user_key][-15:]
-    
-    # Need at least 3 records for pattern detection
-    history = user_analysis_history[user_key]
-    if len(history) < 3:
-        return None
-    
-    # Check for consistent behaviors in the last 5 records
-    behavior_counts = {}
-    for record in history[-5:]:
-        for behavior in record["behaviors"]:
-            if behavior not in behavior_counts:
-                behavior_counts[behavior] = 0
-            behavior_counts[behavior] += 1
-    
-    # Consider a behavior consistent if it appears in at least 3 of the last 5 frames
-    # Give priority to active behaviors - if "Active" appears in 2+ frames, we shouldn't mark "Absent"
-    if "Active" in behavior_counts and behavior_counts["Active"] >= 2:
-        # If student is active in at least 2 frames, they're definitely not consistently absent
-        consistent_behaviors = [behavior for behavior, count in behavior_counts.items() 
-                              if count >= 3 and behavior != "Absent"]
-    else:
-        consistent_behaviors = [behavior for behavior, count in behavior_counts.items() 
-                              if count >= 3]
-    
-    # Don't allow contradictory behaviors (active and absent) to both be consistent
-    if "Active" in consistent_behaviors and "Absent" in consistent_behaviors:
-        consistent_behaviors.remove("Absent")
-    
-    # Looking away shouldn't be marked consistent unless it's in 4+ frames
-    if "Looking away" in behavior_counts and behavior_counts["Looking away"] < 4:
-        if "Looking away" in consistent_behaviors:
-            consistent_behaviors.remove("Looking away")
-    
-    if consistent_behaviors:
-        return consistent_behaviors
-    return None
-
 @app.post("/api/behavior/analyze")
 async def analyze_behavior(
     frame: UploadFile = File(...),
@@ -268,6 +281,11 @@ async def analyze_behavior(
     channelName: str = Form(...),
     username: Optional[str] = Form(None)
 ):
+    # Time the whole analysis so slow frames show up in the watchdog
+    with watchdog.track("analyze_behavior", channel=channelName, userId=userId):
+        return await process_behavior_frame(frame, userId, channelName, username)
+
+async def process_behavior_frame(frame: UploadFile, userId: str, channelName: str, username: Optional[str]):
     # Check if the room exists
     if channelName not in active_rooms:
         raise HTTPException(status_code=404, detail="Room not found")
@@ -291,125 +309,21 @@ async def analyze_behavior(
         # Convert to grayscale for face detection
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         
-        # Detect faces - both frontal and profile with improved parameters
-        frontal_faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(30, 30))
-        profile_faces = profile_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(30, 30))
-        
-        # Combine detected faces
-        faces = list(frontal_faces) + list(profile_faces)
+        # Detect faces and eyes and run the behavior heuristics on this frame
+        record = detect_frames([gray])[0]
         
         # Initialize behavior analysis result
         behavior_result = {
             "userId": userId,
             "username": username,
             "timestamp": datetime.now().isoformat(),
-            "behaviors": [],
-            "severity": "low"
         }
+        behavior_result.update(record_to_result(record))
         
         # User key for tracking behavior history
         user_key = f"{channelName}_{userId}"
         
-        # Get background brightness to help determine if camera is covered
-        avg_brightness = np.mean(gray)
-        very_dark = avg_brightness < 30  # Very dark image might indicate camera is off
-        
-        if len(faces) == 0:
-            # Check if the image is just too dark (camera might be on but in a dark room)
-            if very_dark:
-                behavior_result["behaviors"].append("Dark environment")
-                behavior_result["severity"] = "medium"
-                behavior_result["message"] = "Environment is too dark to detect face clearly"
-            else:
-                # No face detected - student is absent or away
-                behavior_result["behaviors"].append("Absent")
-                behavior_result["severity"] = "high"
-                behavior_result["message"] = "Student appears to be absent - no face detected"
-        else:
-            # Sort faces by size (larger face is likely the primary person)
-            faces = sorted(faces, key=lambda face: face[2] * face[3], reverse=True)
-            
-            # For simplicity, we'll use the largest face detected
-            (x, y, w, h) = faces[0]
-            face_roi = gray[y:y+h, x:x+w]
-            
-            # Detect eyes within the face region
-            eyes = eye_cascade.detectMultiScale(face_roi)
-            
-            if len(eyes) < 2:
-                # Eyes not clearly visible
-                behavior_result["behaviors"].append("Eyes not visible")
-                behavior_result["severity"] = "medium"
-                behavior_result["message"] = "Cannot detect eyes clearly - student may not be looking at screen"
-                
-            else:
-                # Calculate eye positions and movement
-                # This is a simple approximation - a real system would use more sophisticated eye tracking
-                eye_centers = [(ex + ew//2, ey + eh//2) for (ex, ey, ew, eh) in eyes[:2]]
-                
-                # Check if eyes are looking to the side
-                if len(eye_centers) >= 2:
-                    left_eye, right_eye = eye_centers[:2]
-                    eye_distance = abs(left_eye[0] - right_eye[0])
-                    face_width = w
-                    
-                    # If eyes are too close to the edge of the face, person might be looking away
-                    if min(left_eye[0], right_eye[0]) < 0.2 * face_width or max(left_eye[0], right_eye[0]) > 0.8 * face_width:
-                        behavior_result["behaviors"].append("Looking away")
-                        behavior_result["severity"] = "medium"
-                        behavior_result["message"] = "Student appears to be looking away from the screen"
-                    
-                    # Check for potentially drowsy eyes based on eye height
-                    # This is a simple approximation - real drowsiness detection would use eye aspect ratio
-                    eye_heights = [eh for (_, _, _, eh) in eyes[:2]]
-                    avg_eye_height = sum(eye_heights) / len(eye_heights)
-                    if avg_eye_height < 0.15 * h:  # Eyes appear small/closed, using face height (h)
-                        behavior_result["behaviors"].append("Drowsy")
-                        behavior_result["severity"] = "medium"
-                        behavior_result["message"] = "Student appears to be drowsy or tired"
-            
-            # Detect face orientation (approximate)
-            face_height = h
-            face_width = w
-            
-            # Check if face is tilted (simple approximation)
-            if face_height > 1.5 * face_width:
-                behavior_result["behaviors"].append("Head tilted")
-                behavior_result["severity"] = "low"
-                behavior_result["message"] = "Student's head appears to be tilted"
-            
-            # Calculate face position in frame
-            frame_height, frame_width = img.shape[:2]
-            face_center_x = x + w//2
-            face_center_y = y + h//2
-            
-            # Calculate face size relative to frame - larger faces are likely closer to camera
-            face_size_ratio = (w * h) / (frame_width * frame_height)
-            
-            # Check if face is centered in frame - use more relaxed thresholds
-            if face_center_x < frame_width * 0.25 or face_center_x > frame_width * 0.75 or \
-               face_center_y < frame_height * 0.25 or face_center_y > frame_height * 0.75:
-                behavior_result["behaviors"].append("Not centered")
-                behavior_result["severity"] = "low"
-                behavior_result["message"] = "Student not centered in camera view"
-            
-            # Check if the student is active - more lenient criteria
-            # Consider active if face is detected and either:
-            # 1. Eyes are detected, or
-            # 2. Face is reasonably well positioned (even if eyes aren't detected clearly)
-            is_well_positioned = (0.25 * frame_width <= face_center_x <= 0.75 * frame_width and 
-                                 0.25 * frame_height <= face_center_y <= 0.75 * frame_height)
-            
-            if len(eyes) >= 1 or is_well_positioned:
-                # If we detected a face with at least one eye or good positioning, student is likely active
-                behavior_result["behaviors"].append("Active")
-                
-                # Don't override severity if there are higher-priority problems
-                if not any(b in behavior_result["behaviors"] for b in 
-                          ["Looking away", "Drowsy", "Head tilted", "Not centered"]):
-                    behavior_result["message"] = "Student appears to be actively engaged"
-                    behavior_result["severity"] = "low"
-            
+        if record["has_face"]:
             # For demo, sometimes detect random distraction behaviors - reduced probability
             # In a real system, this would use more sophisticated AI models
             if userId != active_rooms[channelName]["host_uid"] and np.random.random() > 0.95:  # 5% chance
@@ -429,28 +343,9 @@ async def analyze_behavior(
                     behavior_result["message"] = selected["message"]
         
         # Check for patterns in behavior
-        consistent_behaviors = analyze_user_behavior_pattern(user_key, behavior_result["behaviors"])
+        consistent_behaviors = analyze_user_behavior_pattern(user_key, behavior_result["behaviors"], user_analysis_history)
         if consistent_behaviors:
-            behavior_result["consistent_behaviors"] = consistent_behaviors
-            
-            # If the same behavior is detected multiple times, increase the severity
-            if behavior_result["severity"] == "low":
-                behavior_result["severity"] = "medium"
-            elif behavior_result["severity"] == "medium" and "Absent" in consistent_behaviors:
-                behavior_result["severity"] = "high"
-            
-            # Update message to reflect consistency
-            if "Absent" in consistent_behaviors:
-                behavior_result["message"] = "Student has been consistently absent"
-            elif "Drowsy" in consistent_behaviors:
-                behavior_result["message"] = "Student appears to be consistently drowsy or tired"
-            elif "Looking away" in consistent_behaviors:
-                behavior_result["message"] = "Student is consistently looking away from the screen"
-            elif "Active" in consistent_behaviors and len(consistent_behaviors) == 1:
-                behavior_result["message"] = "Student is consistently engaged and attentive"
-                behavior_result["severity"] = "low"  # Being active is good
-            else:
-                behavior_result["message"] = f"Consistently showing: {', '.join(consistent_behaviors)}"
+            apply_consistent_behaviors(behavior_result, consistent_behaviors)
         
         # Store the behavior result - limit to 100 entries per channel to prevent memory issues
         behavior_data[channelName].append(behavior_result)
@@ -0,0 +1,301 @@
+"""Event loop lag and slow call watchdog.
+
+A coroutine on the event loop records a heartbeat every tick and measures
+how late it wakes up (loop lag). A background thread watches the heartbeat;
+when the loop has been stuck longer than the lag threshold it samples the
+loop thread's stack, so the code that is blocking the loop is captured while
+it is still running. Calls wrapped with track() are timed, and the same
+thread samples the stack of any call still running past the slow call
+threshold: the loop thread's stack if the call is blocking the loop, or the
+coroutine's await chain if it is waiting on I/O. Slow calls are recorded
+with that sample and any loop stalls they overlapped. Garbage collection
+pauses on the loop thread are timed through gc.callbacks.
+
+Everything is stored in bounded deques so it can stay on permanently.
+"""
+import asyncio
+import cProfile
+import gc
+import io
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Watchdog:
+    def __init__(self, lag_threshold=0.1, slow_call_threshold=0.5, interval=0.25, max_events=50):
+        self.lag_threshold = lag_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.interval = interval
+        # Tick fast enough that blocks just over the threshold are caught and sampled
+        self.tick = min(interval, lag_threshold / 4, slow_call_threshold / 4)
+        self.lag_samples = deque(maxlen=240)
+        self.max_lag = 0.0
+        self.slow_events = deque(maxlen=max_events)
+        # Stalls as {"since", "end", "event"}; end stays None until the loop resumes
+        self.stall_events = deque(maxlen=max_events)
+        self.stall_lock = threading.Lock()
+        self._open_stall = None
+        self.gc_pauses = deque(maxlen=max_events)
+        self.call_stats = {}
+        # Tracked calls in progress, shared with the sampler thread
+        self.active_calls = {}
+        self.active_calls_lock = threading.Lock()
+        self.loop_thread_id = None
+        self.heartbeat = None
+        self.lag_task = None
+        self.stall_thread = None
+        self.running = False
+        self.profiler = None
+        self._gc_start = None
+
+    def start(self):
+        """Start lag monitoring; must be called from the running event loop"""
+        if self.running:
+            return
+        self.running = True
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.lag_task = asyncio.create_task(self._measure_lag())
+        self.stall_thread = threading.Thread(target=self._watch_stalls, name="loop-watchdog", daemon=True)
+        self.stall_thread.start()
+        gc.callbacks.append(self._gc_callback)
+
+    def stop(self):
+        self.running = False
+        if self.lag_task:
+            self.lag_task.cancel()
+            self.lag_task = None
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+        if self.stall_thread:
+            self.stall_thread.join(timeout=self.tick * 4)
+            self.stall_thread = None
+
+    async def _measure_lag(self):
+        """Sleep for a tick and record how late the loop woke us up"""
+        while True:
+            expected = time.monotonic() + self.tick
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            self.heartbeat = now
+            self._finish_stall(now)
+            lag = max(0.0, now - expected)
+            self.lag_samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch_stalls(self):
+        """Sample the loop thread's stack when the heartbeat goes stale"""
+        reported_heartbeat = None
+        while self.running:
+            time.sleep(self.tick)
+            now = time.monotonic()
+            heartbeat = self.heartbeat
+            stalled_for = now - heartbeat - self.tick
+            stalled = stalled_for > self.lag_threshold
+            # Only report each stall once, while it is still in progress
+            if stalled and reported_heartbeat != heartbeat:
+                reported_heartbeat = heartbeat
+                stall = {"since": heartbeat, "end": None, "event": {
+                    "timestamp": datetime.now().isoformat(),
+                    "stalled_ms": round(stalled_for * 1000, 1),
+                    "in_progress": True,
+                    "stack": self._loop_stack(),
+                }}
+                with self.stall_lock:
+                    self._open_stall = stall
+                    self.stall_events.append(stall)
+                # The loop may have resumed while the stack was being sampled
+                self._finish_stall(self.heartbeat)
+                print(f"Event loop blocked for at least {stalled_for * 1000:.0f}ms")
+            self._sample_slow_calls(now, stalled)
+
+    def _finish_stall(self, heartbeat):
+        """Record the real duration of the open stall once the loop has resumed"""
+        with self.stall_lock:
+            stall = self._open_stall
+            if stall is None or heartbeat == stall["since"]:
+                return
+            self._open_stall = None
+            stall["end"] = heartbeat
+            stall["event"]["stalled_ms"] = round((heartbeat - stall["since"] - self.tick) * 1000, 1)
+            stall["event"]["in_progress"] = False
+
+    def _sample_slow_calls(self, now, stalled):
+        """Take one stack sample of every tracked call running past the slow threshold"""
+        with self.active_calls_lock:
+            calls = [call for call in self.active_calls.values()
+                     if call["stack"] is None and now - call["started"] > self.slow_call_threshold]
+        if not calls:
+            return
+        loop_frame = sys._current_frames().get(self.loop_thread_id)
+        for call in calls:
+            # Only blame the blocked loop on the call whose coroutine is actually running
+            if stalled and self._is_running(call["task"], loop_frame):
+                call["stack"] = traceback.format_stack(loop_frame)
+                call["stack_source"] = "blocked event loop"
+            else:
+                call["stack"] = self._task_stack(call["task"])
+                call["stack_source"] = "awaiting"
+
+    @staticmethod
+    def _is_running(task, loop_frame):
+        """Check whether a task's coroutine is on the loop thread's current stack"""
+        if loop_frame is None:
+            return False
+        if task is None:
+            # Tracked code outside a task can't be suspended, so it is what's running
+            return True
+        coro_frame = getattr(task.get_coro(), "cr_frame", None)
+        frame = loop_frame
+        while frame is not None:
+            if frame is coro_frame:
+                return True
+            frame = frame.f_back
+        return False
+
+    def _loop_stack(self):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        return traceback.format_stack(frame) if frame else []
+
+    @staticmethod
+    def _task_stack(task):
+        """Format the await chain of a suspended task, outermost coroutine first"""
+        frames = []
+        awaitable = task.get_coro() if task is not None else None
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            frames.append((frame, frame.f_lineno))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return traceback.StackSummary.extract(frames).format()
+
+    def _stalls_between(self, started, finished):
+        """Return the loop stalls that overlapped a time window"""
+        now = time.monotonic()
+        return [stall["event"] for stall in list(self.stall_events)
+                if stall["since"] < finished and (stall["end"] or now) > started]
+
+    def _gc_callback(self, phase, info):
+        # Collections triggered on other threads don't block the loop
+        if threading.get_ident() != self.loop_thread_id:
+            return
+        if phase == "start":
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            pause = time.perf_counter() - self._gc_start
+            self._gc_start = None
+            if pause > self.lag_threshold / 10:
+                self.gc_pauses.append({
+                    "timestamp": datetime.now().isoformat(),
+                    "generation": info.get("generation"),
+                    "collected": info.get("collected"),
+                    "pause_ms": round(pause * 1000, 2),
+                })
+
+    @contextmanager
+    def track(self, name, **context):
+        """Time a block and record it if it is slower than the threshold"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        call = {"started": time.monotonic(), "task": task, "stack": None}
+        with self.active_calls_lock:
+            self.active_calls[id(call)] = call
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.active_calls_lock:
+                del self.active_calls[id(call)]
+            stats = self.call_stats.setdefault(name, {"count": 0, "slow": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["count"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+            if elapsed > self.slow_call_threshold:
+                stats["slow"] += 1
+                event = {
+                    "timestamp": datetime.now().isoformat(),
+                    "name": name,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    "context": context,
+                    "stack": call["stack"] or [],
+                    "stack_source": call.get("stack_source"),
+                    "loop_stalls": self._stalls_between(call["started"], time.monotonic()),
+                }
+                if tracemalloc.is_tracing():
+                    event["top_allocations"] = self.allocation_snapshot(limit=5)
+                self.slow_events.append(event)
+                print(f"Slow call {name} took {elapsed * 1000:.0f}ms {context}")
+
+    def allocation_snapshot(self, limit=10):
+        """Return the top allocation sites if tracemalloc is tracing"""
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot()
+        return [str(stat) for stat in snapshot.statistics("lineno")[:limit]]
+
+    def set_tracemalloc(self, enabled, frames=5):
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return tracemalloc.is_tracing()
+
+    async def profile(self, seconds, limit=30):
+        """Profile the event loop thread for a number of seconds and return the top functions"""
+        if self.profiler is not None:
+            raise RuntimeError("A profiling session is already running")
+        self.profiler = cProfile.Profile()
+        try:
+            try:
+                self.profiler.enable()
+            except ValueError as e:
+                # Another profiler (e.g. a debugger) already owns the thread
+                raise RuntimeError(f"Could not start profiling: {e}")
+            await asyncio.sleep(seconds)
+            self.profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(self.profiler, stream=output).sort_stats("cumulative").print_stats(limit)
+            return output.getvalue()
+        finally:
+            self.profiler.disable()
+            self.profiler = None
+
+    def report(self):
+        samples = list(self.lag_samples)
+        return {
+            "running": self.running,
+            "lag_threshold_ms": self.lag_threshold * 1000,
+            "slow_call_threshold_ms": self.slow_call_threshold * 1000,
+            "loop_lag_ms": {
+                "current": round(samples[-1] * 1000, 2) if samples else 0.0,
+                "average": round(sum(samples) / len(samples) * 1000, 2) if samples else 0.0,
+                "max_recent": round(max(samples) * 1000, 2) if samples else 0.0,
+                "max": round(self.max_lag * 1000, 2),
+            },
+            "calls": {
+                name: {
+                    "count": stats["count"],
+                    "slow": stats["slow"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 2),
+                    "max_ms": round(stats["max_ms"], 2),
+                }
+                for name, stats in self.call_stats.items()
+            },
+            "slow_calls": list(self.slow_events),
+            "loop_stalls": [stall["event"] for stall in list(self.stall_events)],
+            "gc_pauses": list(self.gc_pauses),
+            "gc_counts": gc.get_count(),
+            "profiling": self.profiler is not None,
+            "tracemalloc": tracemalloc.is_tracing(),
+        }
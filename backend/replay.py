@@ -0,0 +1,243 @@
+"""Offline replay of recorded class sessions through the behavior detection pipeline.
+
+Each source is a video file or a directory of images holding one student's
+session. Frames are decoded in the main process and sent in batches to a
+process pool, where the cascades run on every core. Batch results are
+collected in submission order, so the behavior pattern history of each source
+is built frame by frame exactly as the live server would build it.
+
+Usage:
+    python replay.py session1.mp4 frames/student2 -o results.npz
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from behavior_analysis import FRAME_RECORD_DTYPE, record_to_result
+from detection import detect_frames, analyze_user_behavior_pattern, apply_consistent_behaviors
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def iter_frames(source, stride=1):
+    """Yield (index, name, gray) for frames of a video file or a directory of images.
+
+    index is the position of the frame in the source (file order for
+    directories) and name the image file name, empty for videos. gray is None
+    for frames that could not be decoded.
+    """
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        for index in range(0, len(names), stride):
+            gray = cv2.imread(os.path.join(source, names[index]), cv2.IMREAD_GRAYSCALE)
+            yield index, names[index], gray if gray is not None and gray.size > 0 else None
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+    try:
+        index = 0
+        while True:
+            # grab() skips decoding frames that the stride drops
+            if not capture.grab():
+                break
+            if index % stride == 0:
+                ok, img = capture.retrieve()
+                yield index, "", cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if ok and img is not None else None
+            index += 1
+    finally:
+        capture.release()
+
+
+def iter_readable_frames(source, stride, skipped):
+    """Drop frames that could not be decoded, counting them in skipped[source]"""
+    for index, name, gray in iter_frames(source, stride):
+        if gray is None:
+            skipped[source] += 1
+            continue
+        yield index, name, gray
+
+
+def iter_batches(frames, batch_size):
+    """Group a frame stream into lists of at most batch_size frames"""
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def init_worker():
+    # Every worker runs its own cascades; keep OpenCV from oversubscribing the cores
+    cv2.setNumThreads(1)
+
+
+def detect_batch(indices, grays):
+    """Run detection on one batch in a worker and tag records with their frame index"""
+    records = detect_frames(grays)
+    records["frame"] = indices
+    return records
+
+
+def analyze_batch(source, names, records, history_store):
+    """Run pattern analysis over one batch of records, in frame order.
+
+    Returns a dict of column arrays with one row per frame. The random demo
+    distractions injected by the live handler are not applied.
+    """
+    behaviors = []
+    consistent = []
+    severities = []
+    messages = []
+    for record in records:
+        behavior_result = record_to_result(record)
+        consistent_behaviors = analyze_user_behavior_pattern(source, behavior_result["behaviors"], history_store)
+        if consistent_behaviors:
+            apply_consistent_behaviors(behavior_result, consistent_behaviors)
+        behaviors.append("|".join(behavior_result["behaviors"]))
+        consistent.append("|".join(behavior_result.get("consistent_behaviors", [])))
+        severities.append(behavior_result["severity"])
+        messages.append(behavior_result.get("message", ""))
+
+    columns = {"source": np.full(len(records), source, dtype=object)}
+    columns["name"] = np.array(names, dtype=object)
+    columns.update({name: records[name] for name in FRAME_RECORD_DTYPE.names})
+    columns["behaviors"] = np.array(behaviors, dtype=object)
+    columns["consistent_behaviors"] = np.array(consistent, dtype=object)
+    columns["severity"] = np.array(severities, dtype=object)
+    columns["message"] = np.array(messages, dtype=object)
+    return columns
+
+
+def replay_sources(sources, workers, batch_size=64, stride=1):
+    """Replay sources on a process pool.
+
+    Returns the column dicts of every batch from sources that completed, a
+    dict of errors for sources that failed and the number of frames of each
+    source that could not be decoded. A failing source does not stop the
+    others; its partial results are dropped.
+    """
+    if len(set(sources)) != len(sources):
+        raise ValueError("Each source can only be replayed once")
+
+    results = {}
+    errors = {}
+    skipped = {}
+    history_store = {}
+    # Bound the batches in flight so decoded frames don't pile up in memory
+    pending = deque()
+    max_pending = workers * 2
+
+    def collect(source, names, future):
+        try:
+            records = future.result()
+        except Exception as e:
+            errors.setdefault(source, e)
+        if source in errors:
+            results.pop(source, None)
+            return
+        results[source].append(analyze_batch(source, names, records, history_store))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        for source in sources:
+            results[source] = []
+            skipped[source] = 0
+            try:
+                for batch in iter_batches(iter_readable_frames(source, stride, skipped), batch_size):
+                    indices, names, grays = zip(*batch)
+                    future = executor.submit(detect_batch, np.array(indices), list(grays))
+                    pending.append((source, names, future))
+                    while len(pending) > max_pending:
+                        collect(*pending.popleft())
+                    if source in errors:
+                        break
+            except Exception as e:
+                errors.setdefault(source, e)
+                results.pop(source, None)
+        while pending:
+            collect(*pending.popleft())
+
+    return results, errors, skipped
+
+
+def merge_columns(batches):
+    """Concatenate per-batch column dicts into a single table"""
+    names = list(batches[0].keys())
+    return {name: np.concatenate([batch[name] for batch in batches]) for name in names}
+
+
+def write_columns(columns, path):
+    """Write columns to .npz (one array per column) or .csv"""
+    if path.endswith(".csv"):
+        names = list(columns.keys())
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            writer.writerows(zip(*(columns[name].tolist() for name in names)))
+    else:
+        # Store text columns as fixed-width unicode so the file loads without pickle
+        arrays = {name: values.astype(str) if values.dtype == object else values
+                  for name, values in columns.items()}
+        np.savez_compressed(path, **arrays)
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded sessions through behavior detection")
+    parser.add_argument("sources", nargs="+", help="Video files or directories of images, one per student session")
+    parser.add_argument("-o", "--output", default="replay_results.npz", help="Output file (.npz or .csv)")
+    parser.add_argument("-w", "--workers", type=positive_int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("-b", "--batch-size", type=positive_int, default=16, help="Frames sent to a worker per batch")
+    parser.add_argument("-s", "--stride", type=positive_int, default=1, help="Only analyze every Nth frame")
+    args = parser.parse_args(argv)
+    # Results and pattern history are kept per source path
+    duplicates = sorted({source for source in args.sources if args.sources.count(source) > 1})
+    if duplicates:
+        parser.error(f"sources given more than once: {', '.join(duplicates)}")
+
+    start_time = time.perf_counter()
+    results, errors, skipped = replay_sources(args.sources, args.workers, args.batch_size, args.stride)
+    elapsed = time.perf_counter() - start_time
+
+    for source in args.sources:
+        if source in errors:
+            print(f"{source}: failed - {errors[source]}")
+        else:
+            frames = sum(len(batch["frame"]) for batch in results[source])
+            unreadable = f", {skipped[source]} unreadable frames skipped" if skipped[source] else ""
+            print(f"{source}: {frames} frames{unreadable}")
+
+    batches = [batch for source in args.sources if source in results for batch in results[source]]
+    if not batches:
+        print("No frames were processed, nothing written")
+        return 1
+
+    columns = merge_columns(batches)
+    write_columns(columns, args.output)
+
+    total_frames = len(columns["frame"])
+    fps = total_frames / elapsed if elapsed > 0 else 0.0
+    print(f"Processed {total_frames} frames from {len(results)} sources in {elapsed:.2f}s ({fps:.1f} frames/second)")
+    print(f"Results written to {args.output}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import numpy as np
+
+from behavior_analysis import analyze_frames, pack_eye_boxes, record_to_result, select_primary_faces
+
+FRAME_SHAPE = (400, 400)
+# A 100x100 face centered in a 400x400 frame
+CENTERED_FACE = (150, 150, 100, 100)
+# Two open eyes well inside the face region
+OPEN_EYES = [(25, 30, 20, 20), (55, 30, 20, 20)]
+
+
+def analyze(faces_per_frame, eyes_per_frame, brightness=None, frame_shape=FRAME_SHAPE):
+    """Run a batch through face selection and the heuristics"""
+    n_frames = len(faces_per_frame)
+    face_boxes = [box for faces in faces_per_frame for box in faces]
+    frame_ids = [i for i, faces in enumerate(faces_per_frame) for _ in faces]
+    faces, has_face = select_primary_faces(face_boxes, frame_ids, n_frames)
+    eye_pairs, eye_counts = pack_eye_boxes(eyes_per_frame)
+    if brightness is None:
+        brightness = [100] * n_frames
+    return analyze_frames([frame_shape] * n_frames, brightness, faces, has_face, eye_pairs, eye_counts)
+
+
+def behaviors_of(record):
+    return record_to_result(record)["behaviors"]
+
+
+def test_no_face_is_dark_or_absent():
+    records = analyze([[], []], [(), ()], brightness=[29.9, 30])
+
+    dark = record_to_result(records[0])
+    assert dark["behaviors"] == ["Dark environment"]
+    assert dark["severity"] == "medium"
+
+    absent = record_to_result(records[1])
+    assert absent["behaviors"] == ["Absent"]
+    assert absent["severity"] == "high"
+
+
+def test_engaged_student_is_active():
+    result = record_to_result(analyze([[CENTERED_FACE]], [OPEN_EYES])[0])
+    assert result == {
+        "behaviors": ["Active"],
+        "severity": "low",
+        "message": "Student appears to be actively engaged",
+    }
+
+
+def test_largest_face_wins_and_ties_keep_first_box():
+    frontal = (150, 150, 50, 60)
+    profile = (160, 160, 60, 50)  # Same area as the frontal face
+    small = (0, 0, 30, 30)
+    faces, has_face = select_primary_faces([small, frontal, profile], [0, 0, 0], 1)
+    assert has_face.tolist() == [True]
+    assert tuple(faces[0]) == frontal
+
+    faces, _ = select_primary_faces([small, profile, frontal], [0, 0, 0], 1)
+    assert tuple(faces[0]) == profile
+
+
+def test_looking_away_boundaries():
+    # Eye centers at exactly 20% and 80% of the face width are not looking away
+    inside = [(10, 30, 20, 20), (70, 30, 20, 20)]
+    left = [(9, 30, 20, 20), (70, 30, 20, 20)]
+    right = [(10, 30, 20, 20), (71, 30, 20, 20)]
+    records = analyze([[CENTERED_FACE]] * 3, [inside, left, right])
+    assert "Looking away" not in behaviors_of(records[0])
+    assert "Looking away" in behaviors_of(records[1])
+    assert "Looking away" in behaviors_of(records[2])
+
+
+def test_drowsy_boundary():
+    # Average eye height of exactly 15% of the face height is not drowsy
+    awake = [(25, 30, 20, 15), (55, 30, 20, 15)]
+    drowsy = [(25, 30, 20, 15), (55, 30, 20, 14)]
+    records = analyze([[CENTERED_FACE]] * 2, [awake, drowsy])
+    assert "Drowsy" not in behaviors_of(records[0])
+
+    result = record_to_result(records[1])
+    assert "Drowsy" in result["behaviors"]
+    assert result["severity"] == "medium"
+    assert result["message"] == "Student appears to be drowsy or tired"
+
+
+def test_eyes_not_visible_only_checks_eye_count():
+    records = analyze([[CENTERED_FACE]] * 2, [[(25, 30, 20, 5)], ()])
+    # One eye still counts as active, no eyes needs good positioning
+    assert behaviors_of(records[0]) == ["Eyes not visible", "Active"]
+    assert behaviors_of(records[1]) == ["Eyes not visible", "Active"]
+    assert record_to_result(records[0])["severity"] == "low"
+
+
+def test_centering_boundaries():
+    # Face centers at exactly 25% and 75% of the frame are still centered
+    on_low_edge = (50, 50, 100, 100)
+    on_high_edge = (250, 250, 100, 100)
+    outside = (49, 150, 100, 100)
+    records = analyze([[on_low_edge], [on_high_edge], [outside]], [(), (), ()])
+    assert behaviors_of(records[0]) == ["Eyes not visible", "Active"]
+    assert behaviors_of(records[1]) == ["Eyes not visible", "Active"]
+    # Not centered and no eyes: not active either
+    result = record_to_result(records[2])
+    assert result["behaviors"] == ["Eyes not visible", "Not centered"]
+    assert result["severity"] == "low"
+    assert result["message"] == "Student not centered in camera view"
+
+
+def test_head_tilted():
+    tall = (150, 125, 100, 151)
+    tall_eyes = [(25, 30, 20, 25), (55, 30, 20, 25)]
+    records = analyze([[tall]], [tall_eyes])
+    result = record_to_result(records[0])
+    assert result["behaviors"] == ["Head tilted", "Active"]
+    assert result["message"] == "Student's head appears to be tilted"
+
+
+def test_batch_with_faceless_frames():
+    faces_per_frame = [[], [(0, 0, 30, 30), CENTERED_FACE], [], [CENTERED_FACE]]
+    eyes_per_frame = [(), OPEN_EYES, (), ()]
+    records = analyze(faces_per_frame, eyes_per_frame, brightness=[100, 100, 10, 100])
+
+    assert records["frame"].tolist() == [0, 1, 2, 3]
+    assert records["has_face"].tolist() == [False, True, False, True]
+    assert tuple(records[["x", "y", "w", "h"]][1]) == CENTERED_FACE
+    assert records["eye_count"].tolist() == [0, 2, 0, 0]
+    assert [behaviors_of(record) for record in records] == [
+        ["Absent"],
+        ["Active"],
+        ["Dark environment"],
+        ["Eyes not visible", "Active"],
+    ]
+
+
+def test_empty_batch():
+    faces, has_face = select_primary_faces(np.empty((0, 4)), np.empty(0), 0)
+    eye_pairs, eye_counts = pack_eye_boxes([])
+    records = analyze_frames(np.empty((0, 2)), [], faces, has_face, eye_pairs, eye_counts)
+    assert len(records) == 0
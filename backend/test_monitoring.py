@@ -0,0 +1,162 @@
+import asyncio
+import gc
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import config
+import main
+from monitoring import Watchdog
+
+
+def run_with_watchdog(scenario, **settings):
+    """Run a coroutine with a started watchdog and return the watchdog"""
+    settings.setdefault("lag_threshold", 0.05)
+    settings.setdefault("slow_call_threshold", 0.2)
+    watchdog = Watchdog(**settings)
+
+    async def runner():
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.05)
+            await scenario(watchdog)
+            # Let the heartbeat resume so stalls get their final duration
+            await asyncio.sleep(0.05)
+        finally:
+            watchdog.stop()
+
+    asyncio.run(runner())
+    return watchdog
+
+
+def blocker(watchdog, seconds):
+    with watchdog.track("analyze_behavior", channel="room"):
+        time.sleep(seconds)
+
+
+async def waiter(watchdog, seconds):
+    with watchdog.track("broadcast_to_channel", channel="room"):
+        await asyncio.sleep(seconds)
+
+
+def slow_call(watchdog, name):
+    events = [event for event in watchdog.report()["slow_calls"] if event["name"] == name]
+    assert len(events) == 1
+    return events[0]
+
+
+def test_blocking_call_is_recorded_with_its_stack():
+    async def scenario(watchdog):
+        blocker(watchdog, 0.4)
+
+    watchdog = run_with_watchdog(scenario)
+
+    event = slow_call(watchdog, "analyze_behavior")
+    assert event["context"] == {"channel": "room"}
+    assert event["stack_source"] == "blocked event loop"
+    assert "in blocker" in event["stack"][-1]
+    assert "time.sleep" in event["stack"][-1]
+
+    # The overlapping stall is attached with its real duration, not the detection time
+    assert len(event["loop_stalls"]) == 1
+    stall = event["loop_stalls"][0]
+    assert stall["in_progress"] is False
+    assert 350 < stall["stalled_ms"] < 600
+    assert watchdog.report()["calls"]["analyze_behavior"]["slow"] == 1
+
+
+def test_awaiting_call_gets_its_own_task_stack():
+    async def scenario(watchdog):
+        # The broadcast is awaiting while another call blocks the loop
+        broadcast = asyncio.create_task(waiter(watchdog, 0.5))
+        await asyncio.sleep(0.01)
+        blocker(watchdog, 0.4)
+        await broadcast
+
+    watchdog = run_with_watchdog(scenario)
+
+    event = slow_call(watchdog, "broadcast_to_channel")
+    assert event["stack_source"] == "awaiting"
+    assert any("in waiter" in line for line in event["stack"])
+    assert not any("in blocker" in line for line in event["stack"])
+
+    assert "in blocker" in slow_call(watchdog, "analyze_behavior")["stack"][-1]
+
+
+def test_short_block_over_lag_threshold_is_caught():
+    async def scenario(watchdog):
+        time.sleep(0.15)
+
+    watchdog = run_with_watchdog(scenario, lag_threshold=0.1, slow_call_threshold=0.5)
+
+    stalls = watchdog.report()["loop_stalls"]
+    assert len(stalls) == 1
+    assert any("in scenario" in line for line in stalls[0]["stack"])
+
+
+def test_stop_joins_thread_and_removes_gc_callback():
+    async def scenario(watchdog):
+        assert watchdog._gc_callback in gc.callbacks
+        assert watchdog.stall_thread.is_alive()
+
+    watchdog = run_with_watchdog(scenario)
+
+    assert watchdog.stall_thread is None
+    assert watchdog._gc_callback not in gc.callbacks
+    assert not watchdog.running
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(config, "WATCHDOG_ADMIN_TOKEN", "s3cret")
+    return TestClient(main.app)
+
+
+ADMIN_HEADERS = {"X-Admin-Token": "s3cret"}
+
+
+def test_admin_endpoints_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(config, "WATCHDOG_ADMIN_TOKEN", "")
+    assert client.get("/api/admin/watchdog", headers=ADMIN_HEADERS).status_code == 404
+    assert client.post("/api/admin/watchdog/profile", json={}, headers=ADMIN_HEADERS).status_code == 404
+    assert client.post("/api/admin/watchdog/tracemalloc", json={}, headers=ADMIN_HEADERS).status_code == 404
+
+
+# Headers are decoded as latin-1, so non-ASCII tokens must not break the comparison
+@pytest.mark.parametrize("token", [b"", b"wrong", b"\xe9"])
+def test_admin_endpoints_reject_bad_token(client, token):
+    response = client.get("/api/admin/watchdog", headers={"X-Admin-Token": token})
+    assert response.status_code == 403
+
+
+def test_admin_report(client):
+    response = client.get("/api/admin/watchdog", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert "loop_lag_ms" in response.json()
+
+
+@pytest.mark.parametrize("body", [
+    {"seconds": "abc"},
+    {"seconds": None},
+    {"seconds": 0},
+    {"seconds": 61},
+    {"limit": "x"},
+    {"limit": 0},
+])
+def test_profile_rejects_bad_input(client, body):
+    response = client.post("/api/admin/watchdog/profile", json=body, headers=ADMIN_HEADERS)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("enabled", ["false", 0, None])
+def test_tracemalloc_requires_boolean(client, enabled):
+    response = client.post("/api/admin/watchdog/tracemalloc", json={"enabled": enabled}, headers=ADMIN_HEADERS)
+    assert response.status_code == 400
+
+
+def test_tracemalloc_toggle(client):
+    response = client.post("/api/admin/watchdog/tracemalloc", json={"enabled": True}, headers=ADMIN_HEADERS)
+    assert response.json()["tracemalloc"] is True
+    response = client.post("/api/admin/watchdog/tracemalloc", json={"enabled": False}, headers=ADMIN_HEADERS)
+    assert response.json() == {"tracemalloc": False, "top_allocations": []}
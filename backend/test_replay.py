@@ -0,0 +1,86 @@
+import csv
+
+import cv2
+import numpy as np
+import pytest
+
+import replay
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    """A directory of 6 images (one corrupt) and a 5 frame video"""
+    image_dir = tmp_path / "imgs"
+    image_dir.mkdir()
+    for i in range(6):
+        # Alternate dark and bright frames, neither has a face
+        img = np.full((120, 160, 3), 10 if i % 2 else 120, np.uint8)
+        cv2.imwrite(str(image_dir / f"{i:03d}.png"), img)
+    (image_dir / "003.png").write_text("not an image")
+
+    video = tmp_path / "session.avi"
+    writer = cv2.VideoWriter(str(video), cv2.VideoWriter_fourcc(*"MJPG"), 10, (160, 120))
+    for i in range(5):
+        writer.write(np.full((120, 160, 3), 120, np.uint8))
+    writer.release()
+    return str(image_dir), str(video)
+
+
+def test_replay_writes_rows_in_frame_order(sessions, tmp_path, capsys):
+    image_dir, video = sessions
+    output = str(tmp_path / "out.npz")
+
+    assert replay.main([image_dir, video, "-o", output, "-w", "2", "-b", "2"]) == 0
+
+    columns = np.load(output)
+    assert columns["source"].tolist() == [image_dir] * 5 + [video] * 5
+    # The corrupt image is skipped without shifting the indices of later frames
+    assert columns["frame"].tolist() == [0, 1, 2, 4, 5, 0, 1, 2, 3, 4]
+    assert columns["name"].tolist() == ["000.png", "001.png", "002.png", "004.png", "005.png"] + [""] * 5
+    assert columns["behaviors"].tolist()[:3] == ["Absent", "Dark environment", "Absent"]
+    # The pattern history starts over for every source
+    assert columns["consistent_behaviors"].tolist()[5:] == ["", "", "Absent", "Absent", "Absent"]
+    assert "1 unreadable frames skipped" in capsys.readouterr().out
+
+
+def test_replay_stride_keeps_source_indices(sessions, tmp_path):
+    image_dir, video = sessions
+    output = str(tmp_path / "out.npz")
+
+    assert replay.main([image_dir, video, "-o", output, "-s", "2"]) == 0
+
+    columns = np.load(output)
+    assert columns["frame"].tolist() == [0, 2, 4, 0, 2, 4]
+
+
+def test_missing_source_is_reported_and_others_written(sessions, tmp_path, capsys):
+    image_dir, video = sessions
+    missing = str(tmp_path / "missing.mp4")
+    output = str(tmp_path / "out.csv")
+
+    assert replay.main([missing, video, image_dir, "-o", output, "-w", "2", "-b", "1"]) == 1
+    assert f"{missing}: failed" in capsys.readouterr().out
+
+    with open(output, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["source"] for row in rows] == [video] * 5 + [image_dir] * 5
+    assert [row["name"] for row in rows[5:]] == ["000.png", "001.png", "002.png", "004.png", "005.png"]
+    assert rows[0]["severity"] == "high"
+    assert rows[0]["message"] == "Student appears to be absent - no face detected"
+
+
+def test_only_failed_sources_writes_nothing(tmp_path):
+    output = tmp_path / "out.npz"
+    assert replay.main([str(tmp_path / "missing.mp4"), "-o", str(output)]) == 1
+    assert not output.exists()
+
+
+@pytest.mark.parametrize("option", ["-w", "-b", "-s"])
+def test_non_positive_options_are_rejected(sessions, option):
+    with pytest.raises(SystemExit):
+        replay.main([sessions[0], option, "0"])
+
+
+def test_duplicate_sources_are_rejected(sessions):
+    with pytest.raises(SystemExit):
+        replay.main([sessions[0], sessions[0]])